@@ -1,15 +1,20 @@
 import os
+import re
+import sys
 import argparse
 import subprocess
 import logging
+import logging.handlers
 import json
 import shutil
-import tempfile
+import threading
+import multiprocessing
 from pathlib import Path
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Tuple, Optional
+from typing import Iterator, List, Tuple, Optional
 #
 #   brew install mozjpeg optipng pngquant zopfli webp gifsicle
 #   pip3 install tqdm
@@ -19,229 +24,998 @@ from typing import List, Tuple, Optional
 
 
 # 配置常量
-IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff']
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'})
 DEFAULT_BACKUP_DIR = '.image_backup'
 DEFAULT_LOG_FILE = 'compression.log'
+# 已处理文件索引：路径 -> [大小, mtime_ns]，重跑时据此整个跳过
+DEFAULT_CACHE_FILE = '.image_compressor_cache.json'
+# 每次工具调用处理的文件数，摊薄fork+exec开销
+BATCH_SIZE = 32
+
+# 让subprocess走CPython(>=3.8)的posix_spawn快速路径：条件是
+# close_fds=False、不传preexec_fn/cwd等（见subprocess._USE_POSIX_SPAWN），
+# 且可执行文件必须带目录（裸命令名过不了Popen里的dirname检查，
+# 仍会退回fork+exec）——所以available_tools里存的是which解析出的
+# 绝对路径，所有argv都从那里取。
+# 大RSS的父进程plain fork要复制整套页表，posix_spawn近乎常数开销。
+# stdin统一接/dev/null，防止工具意外读终端。
+_SPAWN_OPTS = {'close_fds': False, 'stdin': subprocess.DEVNULL}
+
+logger = logging.getLogger(__name__)
+
+
+def _mp_context():
+    """选多进程启动方式：forkserver优先，不可用（Windows）退spawn
+
+    forkserver没有fork的线程安全隐患，起进程又比spawn省掉重新
+    解释器初始化的一大截；Windows只有spawn。
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+# io_uring加速备份拷贝（可选依赖，仅Linux）:
+#   pip3 install liburing
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+# 小文件进程内转码（可选依赖；装Pillow-SIMD可得SIMD加速的编解码）:
+#   pip3 install Pillow-SIMD  （或 Pillow）
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 低于该大小时子进程开销远大于编解码本身，直接进程内处理
+INLINE_THRESHOLD = 64 * 1024
+
+# 单次io_uring_enter最多提交的SQE数、每个读写链搬运的字节数
+_URING_QUEUE_DEPTH = 64
+_URING_CHUNK = 1 << 20
+
+
+@dataclass
+class FileResult:
+    """单个文件的压缩结果，由工作进程返回、主进程汇总
+
+    status取值: 'compressed' / 'skipped' / 'failed'
+    """
+    path: str
+    original: int
+    compressed: int
+    status: str
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    """单次stat封装，文件不存在/不可达时返回None
+
+    统一用一次os.stat拿大小，替代getsize+exists的连环stat调用；
+    在NFS/SMB上元数据操作很贵，省一半stat就省一半往返。
+    """
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _copy_file_uring(src: str, dst: str) -> bool:
+    """用io_uring拷贝文件，不可用或出错时返回False走常规路径
+
+    每个分片是一对READV→WRITEV（IOSQE_IO_LINK串联保证先读后写），
+    攒满队列深度才io_uring_enter一次，把多次SSD往返的延迟摊到
+    一次提交里；相比同步pread/pwrite循环，队列深度32~64时IOPS
+    可以高出数倍。
+    """
+    if liburing is None or sys.platform != 'linux':
+        return False
+
+    src_fd = dst_fd = -1
+    ring = liburing.io_uring()
+    try:
+        size = os.stat(src).st_size
+        src_fd = os.open(src, os.O_RDONLY)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        liburing.io_uring_queue_init(_URING_QUEUE_DEPTH, ring, 0)
+
+        offset = 0
+        while offset < size:
+            # 组一批读写链，一次提交
+            inflight = 0
+            buffers = []  # 持有引用，防止内核写入期间被回收
+            while offset < size and inflight + 2 <= _URING_QUEUE_DEPTH:
+                length = min(_URING_CHUNK, size - offset)
+                buf = bytearray(length)
+                iov = liburing.iovec(buf)
+                buffers.append((buf, iov))
+
+                sqe = liburing.io_uring_get_sqe(ring)
+                liburing.io_uring_prep_readv(sqe, src_fd, iov, 1, offset)
+                sqe.flags |= liburing.IOSQE_IO_LINK
+
+                sqe = liburing.io_uring_get_sqe(ring)
+                liburing.io_uring_prep_writev(sqe, dst_fd, iov, 1, offset)
+
+                offset += length
+                inflight += 2
+
+            liburing.io_uring_submit(ring)
+            cqe = liburing.io_uring_cqe()
+            for _ in range(inflight):
+                liburing.io_uring_wait_cqe(ring, cqe)
+                if cqe.res < 0:
+                    raise OSError(-cqe.res, os.strerror(-cqe.res))
+                liburing.io_uring_cqe_seen(ring, cqe)
+
+        shutil.copystat(src, dst)
+        return True
+    except Exception as e:
+        logger.debug(f"io_uring拷贝失败，回退常规拷贝 {src}: {e}")
+        return False
+    finally:
+        try:
+            liburing.io_uring_queue_exit(ring)
+        except Exception:
+            pass
+        for fd in (src_fd, dst_fd):
+            if fd >= 0:
+                os.close(fd)
+
+
+def _clone_or_copy(src: str, dst: str) -> None:
+    """备份专用复制：优先零拷贝，退化路径才逐字节复制
+
+    压缩成功后原文件是被os.replace整体换掉的（新inode），
+    所以硬链接备份保住的是旧inode和旧内容，语义上等同一份拷贝。
+    这个前提要求原文件的inode绝不被改写：原地改写的工具一律
+    只拿_copy_data复制出的工作副本，不碰原文件。
+    """
+    if os.path.exists(dst):
+        os.unlink(dst)
+
+    # 同一文件系统：硬链接，O(1)且零字节拷贝
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        # 跨文件系统(EXDEV)或文件系统不支持硬链接
+        pass
+
+    # Linux: copy_file_range走reflink或内核内拷贝，不经过用户态缓冲
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    shutil.copystat(src, dst)
+                    return
+        except OSError:
+            pass
+
+    # 跨文件系统且copy_file_range不可用：尝试io_uring批量读写
+    if _copy_file_uring(src, dst):
+        return
+
+    # macOS/APFS: clonefile即reflink
+    if sys.platform == 'darwin':
+        try:
+            import ctypes
+            libsystem = ctypes.CDLL('/usr/lib/libSystem.B.dylib', use_errno=True)
+            if libsystem.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+                return
+        except (OSError, AttributeError):
+            pass
+
+    shutil.copy2(src, dst)
+
+
+def _copy_data(src: str, dst: str) -> None:
+    """为原地改写的工具准备独立inode的工作副本
+
+    这里不能用硬链接：gifsicle --batch、optipng这类工具是对输出
+    文件truncate后重写，经硬链接会把原文件（和硬链接方式的备份）
+    一起改掉。优先copy_file_range走内核内拷贝/reflink，不可用时
+    退回普通拷贝。
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def create_backup(file_path: str, backup_cfg: Tuple) -> bool:
+    """创建文件备份
+
+    backup_cfg是 (backup_enabled, backup_dir, force_no_backup_check, cwd)
+    元组，cwd在主进程取一次后随任务下发，省去每文件一次getcwd。
+    备份根目录已在主进程建好，这里只补建子目录。
+    """
+    backup_enabled, backup_dir, force_no_backup_check, cwd = backup_cfg
+
+    # 如果强制禁用备份检查，直接返回成功
+    if force_no_backup_check:
+        return True
+
+    if not backup_enabled:
+        return True
+
+    try:
+        # 保持原始目录结构
+        rel_path = Path(file_path).resolve().relative_to(cwd)
+        backup_file = Path(backup_dir) / rel_path
+        backup_file.parent.mkdir(parents=True, exist_ok=True)
+
+        _clone_or_copy(file_path, str(backup_file))
+        return True
+    except Exception as e:
+        logger.error(f"备份失败 {file_path}: {e}")
+        return False
+
+
+# 每个工作进程常驻一个bash助手：循环从stdin读文件名并执行JPEG工具，
+# 复用已加载的工具镜像，免去逐文件fork+exec的加载开销
+_JPEG_HELPER = None
+_JPEG_HELPER_KEY = None
+
+# 以制表符分隔输入/输出路径，每处理完一个文件回显退出码
+_JPEG_HELPER_SCRIPT = (
+    "while IFS=$'\\t' read -r src dst; do "
+    '{command} >/dev/null 2>&1; echo $?; done\n'
+)
+
+# jpegtran只重排熵编码，无损且比cjpeg整解整编快得多
+_JPEGTRAN_CMD = '"{tool}" -optimize -progressive -copy none -outfile "$dst" "$src"'
+_CJPEG_CMD = '"{tool}" -quality {quality} -optimize -progressive -outfile "$dst" "$src"'
+
+
+def _get_jpeg_helper(quality: int, use_jpegtran: bool, tool_path: str):
+    """取得（必要时启动）本进程的常驻JPEG压缩助手"""
+    global _JPEG_HELPER, _JPEG_HELPER_KEY
+
+    key = (quality, use_jpegtran, tool_path)
+    if _JPEG_HELPER is not None and _JPEG_HELPER_KEY == key:
+        if _JPEG_HELPER.poll() is None:
+            return _JPEG_HELPER
+        _JPEG_HELPER = None
+
+    bash = shutil.which('bash') if os.name == 'posix' else None
+    if bash is None:
+        return None
+
+    if use_jpegtran:
+        command = _JPEGTRAN_CMD.format(tool=tool_path)
+    else:
+        command = _CJPEG_CMD.format(tool=tool_path, quality=quality)
+    try:
+        _JPEG_HELPER = subprocess.Popen(
+            [bash, '-s'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, bufsize=1, close_fds=False)
+        _JPEG_HELPER.stdin.write(_JPEG_HELPER_SCRIPT.format(command=command))
+        _JPEG_HELPER.stdin.flush()
+        _JPEG_HELPER_KEY = key
+    except Exception as e:
+        logger.warning(f"常驻压缩助手启动失败，回退为逐文件调用: {e}")
+        _JPEG_HELPER = None
+    return _JPEG_HELPER
+
+
+# 第三方优化器写进JPEG注释段的特征串，出现即认为无需再压
+_OPTIMIZED_JPEG_MARKERS = (b'mozjpeg', b'Intel(R) JPEG Library')
+
+
+def _looks_optimized_jpeg(path: str) -> bool:
+    """只读头部1KB，粗略识别已被优化器处理过的JPEG"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(1024)
+        return any(marker in head for marker in _OPTIMIZED_JPEG_MARKERS)
+    except OSError:
+        return False
+
+
+def compress_jpeg(input_path: str, opt_path: str, quality: int, tools: dict,
+                  relossy: bool = False) -> Optional[bool]:
+    """压缩JPEG文件，工具直接从原文件读、写入opt_path
+
+    默认用jpegtran做熵编码级的无损重优化（不动像素，比cjpeg
+    整解整编快数倍）；--relossy时才用cjpeg按quality重编码。
+    返回True表示已产出opt文件，None表示无可用工具（跳过），
+    False表示工具执行失败（报failed，下次运行重试）。
+    """
+    try:
+        use_jpegtran = bool(tools.get('jpegtran')) and not relossy
+        if not use_jpegtran and not tools['mozjpeg']:
+            logger.warning("mozjpeg不可用，跳过JPEG优化")
+            return None
+        tool_path = tools['jpegtran'] if use_jpegtran else tools['mozjpeg']
+
+        # 优先走常驻助手（路径含制表符/换行时协议无法表达，走直接调用）
+        if '\t' not in input_path and '\n' not in input_path:
+            helper = _get_jpeg_helper(quality, use_jpegtran, tool_path)
+            if helper is not None:
+                try:
+                    helper.stdin.write(f'{input_path}\t{opt_path}\n')
+                    helper.stdin.flush()
+                    rc = helper.stdout.readline().strip()
+                    if rc == '0':
+                        return True
+                    logger.error(f"JPEG压缩失败: {input_path} (exit {rc or '?'})")
+                    return False
+                except (BrokenPipeError, OSError):
+                    # 助手挂掉，回退为直接调用
+                    pass
+
+        # 直接调用（Windows或bash不可用时的回退路径）
+        if use_jpegtran:
+            cmd = [tool_path, '-optimize', '-progressive', '-copy', 'none',
+                   '-outfile', opt_path, input_path]
+        else:
+            cmd = [tool_path, '-quality', str(quality), '-optimize',
+                   '-progressive', '-outfile', opt_path, input_path]
+        subprocess.run(cmd, capture_output=True, text=True, check=True, **_SPAWN_OPTS)
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"JPEG压缩失败: {e.stderr}")
+        return False
+    except Exception as e:
+        logger.error(f"JPEG压缩异常: {e}")
+        return False
+
+
+def compress_png(input_path: str, opt_path: str, tools: dict) -> Optional[bool]:
+    """压缩PNG文件，工具直接从原文件读、写入opt_path
+
+    返回值约定同compress_jpeg：True产出/None无工具/False失败。
+    """
+    compressed = False
+
+    try:
+        # 使用pngquant进行有损压缩（可选），输出直接写到opt_path
+        if tools['pngquant']:
+            result = subprocess.run([
+                tools['pngquant'], '--quality=65-80', '--output', opt_path, input_path
+            ], capture_output=True, text=True, **_SPAWN_OPTS)
+
+            # 退出码0即已写出，不必再exists确认
+            if result.returncode == 0:
+                compressed = True
+
+        # 无损优化器：pngquant已有产出就接着优化opt（独立inode，
+        # 原地改写安全）；没有产出时绝不硬链接原文件——要么让工具
+        # 输入输出分开写，要么先_copy_data出工作副本
+        if tools['oxipng'] or tools['optipng'] or tools['zopflipng']:
+            # 优先oxipng（多线程），其次optipng
+            if tools['oxipng']:
+                if compressed:
+                    cmd = [tools['oxipng'], '-o', '2', '--quiet', opt_path]
+                else:
+                    cmd = [tools['oxipng'], '-o', '2', '--quiet',
+                           '--out', opt_path, input_path]
+                # oxipng默认多线程，调用期间放开本worker的绑核
+                mask = _widen_affinity()
+                try:
+                    subprocess.run(cmd, capture_output=True, check=True, **_SPAWN_OPTS)
+                finally:
+                    _restore_affinity(mask)
+                compressed = True
+            elif tools['optipng']:
+                # optipng只会原地改写，先备好独立inode的副本
+                if not compressed:
+                    _copy_data(input_path, opt_path)
+                subprocess.run([
+                    tools['optipng'], '-o2', '-quiet', opt_path
+                ], capture_output=True, check=True, **_SPAWN_OPTS)
+                compressed = True
+
+            # 使用zopflipng进一步优化（输入输出分开传）
+            elif tools['zopflipng']:
+                src = opt_path if compressed else input_path
+                subprocess.run([
+                    tools['zopflipng'], '-y', src, opt_path
+                ], capture_output=True, check=True, **_SPAWN_OPTS)
+                compressed = True
+
+        return True if compressed else None
+    except subprocess.CalledProcessError as e:
+        logger.error(f"PNG压缩失败: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"PNG压缩异常: {e}")
+        return False
+
+
+def compress_gif(input_path: str, opt_path: str, tools: dict) -> Optional[bool]:
+    """压缩GIF文件，工具直接从原文件读、写入opt_path
+
+    返回值约定同compress_jpeg：True产出/None无工具/False失败。
+    """
+    try:
+        if tools['gifsicle']:
+            subprocess.run([
+                tools['gifsicle'], '-O3', '-o', opt_path, input_path
+            ], capture_output=True, check=True, **_SPAWN_OPTS)
+            return True
+        return None
+    except subprocess.CalledProcessError as e:
+        logger.error(f"GIF压缩失败: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"GIF压缩异常: {e}")
+        return False
+
+
+def _compress_inline(input_path: str, opt_path: str, file_ext: str,
+                     quality: int, relossy: bool) -> bool:
+    """小图直接在进程内用Pillow转码，完全绕开子进程
+
+    JPEG只在--relossy模式内联（Pillow重编码是有损的，与cjpeg语义
+    一致；默认的jpegtran无损路径不能用它替代）；PNG走无损optimize。
+    失败时返回False交给外部工具。
+    """
+    if Image is None:
+        return False
+    try:
+        with Image.open(input_path) as img:
+            if file_ext in ('.jpg', '.jpeg'):
+                if not relossy:
+                    return False
+                img.save(opt_path, 'JPEG', quality=quality,
+                         optimize=True, progressive=True)
+            elif file_ext == '.png':
+                img.save(opt_path, 'PNG', optimize=True)
+            else:
+                return False
+        return True
+    except Exception as e:
+        logger.debug(f"Pillow内联压缩失败，改走外部工具 {input_path}: {e}")
+        try:
+            os.unlink(opt_path)
+        except OSError:
+            pass
+        return False
+
+
+def _finalize_opt(input_path: str, original_size: int, opt_path: str,
+                  compressed_size: Optional[int] = None,
+                  tool_failed: bool = False) -> FileResult:
+    """比较压缩结果，有效时原子替换原文件，返回结果元组
+
+    compressed_size可由调用方从工具输出里解析得到（省一次stat，
+    网络文件系统上stat是一次完整往返）；传None则stat兜底。
+    tool_failed=True表示工具链报过错：没有产出或没有变小的文件
+    一律按failed返回（不进索引），防止把一次瞬时失败当成"已处理"
+    永久缓存掉。
+    """
+    if compressed_size is None:
+        opt_st = _stat(opt_path)
+        if opt_st is None:
+            # 工具没有产出结果文件
+            status = 'failed' if tool_failed else 'skipped'
+            return FileResult(input_path, original_size, original_size, status)
+        compressed_size = opt_st.st_size
+
+    if compressed_size < original_size:
+        # 压缩有效，原子替换原文件（备份已另存，原地写入安全）
+        try:
+            os.replace(opt_path, input_path)
+        except OSError as e:
+            logger.error(f"替换原文件失败 {input_path}: {e}")
+            return FileResult(input_path, original_size, original_size, 'failed')
+        return FileResult(input_path, original_size, compressed_size, 'compressed')
+
+    os.unlink(opt_path)
+    if tool_failed:
+        return FileResult(input_path, original_size, original_size, 'failed')
+    logger.info(f"○ 跳过: {input_path} (压缩后更大)")
+    return FileResult(input_path, original_size, original_size, 'skipped')
+
+
+def _prepare_batch(paths: List[str], backup_cfg: Tuple,
+                   results: List[FileResult]
+                   ) -> List[Tuple[str, int, str]]:
+    """批量压缩前的公共准备：取大小、做备份、清掉残留的.opt文件"""
+    pending = []
+    for path in paths:
+        st = _stat(path)
+        if st is None:
+            logger.error(f"文件不存在: {path}")
+            results.append(FileResult(path, 0, 0, 'failed'))
+            continue
+        original_size = st.st_size
+
+        if not create_backup(path, backup_cfg):
+            logger.error(f"无法创建备份，跳过文件: {path}")
+            results.append(FileResult(path, original_size, original_size, 'failed'))
+            continue
+
+        opt_path = f'{path}.opt'
+        try:
+            os.unlink(opt_path)
+        except OSError:
+            pass
+        pending.append((path, original_size, opt_path))
+    return pending
+
+
+def _parse_optipng_sizes(output: str) -> dict:
+    """从optipng的输出恢复每个文件的输出字节数
+
+    optipng对每个文件打印 "** Processing: <path>" 和
+    "Output file size = N bytes"；解析不到的文件由调用方stat兜底。
+    """
+    sizes = {}
+    current = None
+    try:
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith('** Processing:'):
+                current = line.split(':', 1)[1].strip()
+            elif current and line.startswith('Output file size'):
+                match = re.search(r'(\d+)', line)
+                if match:
+                    sizes[current] = int(match.group(1))
+                current = None
+    except Exception:
+        # 输出格式对不上就整体放弃，走stat
+        return {}
+    return sizes
+
+
+def compress_png_batch(paths: List[str], tools: dict, backup_cfg: Tuple
+                       ) -> List[FileResult]:
+    """批量压缩一组PNG文件，整批只调用一次工具进程"""
+    results: List[FileResult] = []
+    pending = _prepare_batch(paths, backup_cfg, results)
+    if not pending:
+        return results
+
+    # 小PNG先在进程内转码，剩下的才交给外部工具
+    parsed_sizes = {}
+    batch_failed = False
+    tool_pending = []
+    for path, original_size, opt_path in pending:
+        if (original_size < INLINE_THRESHOLD and
+                _compress_inline(path, opt_path, '.png', 0, False)):
+            continue
+        tool_pending.append((path, original_size, opt_path))
+
+    try:
+        # pngquant支持多文件：--ext让 a.png 的输出落在 a.png.opt
+        if tool_pending and tools['pngquant']:
+            subprocess.run(
+                [tools['pngquant'], '--quality=65-80', '--force', '--ext', '.png.opt', '--']
+                + [path for path, _, _ in tool_pending],
+                capture_output=True, text=True, **_SPAWN_OPTS)
+
+        if tool_pending and (tools['oxipng'] or tools['optipng'] or tools['zopflipng']):
+            if tools['oxipng'] or tools['optipng']:
+                # 这两个工具按原地改写用：pngquant失败/跳过的文件补
+                # 一份工作副本，且必须是独立inode——硬链接会把原文件
+                # 连同硬链接方式的备份一起改掉
+                for path, _, opt_path in tool_pending:
+                    if _stat(opt_path) is None:
+                        _copy_data(path, opt_path)
+
+            if tools['oxipng']:
+                # oxipng是多线程实现，整批一次调用吃满所有核；
+                # 调用期间临时放开本worker的绑核，否则它的线程会
+                # 继承单核掩码、全部挤在一个核上轮转
+                mask = _widen_affinity()
+                try:
+                    result = subprocess.run(
+                        [tools['oxipng'], '-o', '2', '--threads', str(os.cpu_count() or 1),
+                         '--quiet', '--']
+                        + [opt_path for _, _, opt_path in tool_pending],
+                        capture_output=True, **_SPAWN_OPTS)
+                finally:
+                    _restore_affinity(mask)
+                batch_failed = result.returncode != 0
+            elif tools['optipng']:
+                # optipng接受多文件，逐个原地优化；不加-quiet，
+                # 从它的输出里直接拿结果大小，省掉每个文件一次stat
+                result = subprocess.run(
+                    [tools['optipng'], '-o2']
+                    + [opt_path for _, _, opt_path in tool_pending],
+                    capture_output=True, text=True, **_SPAWN_OPTS)
+                batch_failed = result.returncode != 0
+                parsed_sizes = _parse_optipng_sizes(result.stderr + result.stdout)
+            elif tools['zopflipng']:
+                # 输入输出分开传：没有pngquant产出的直接从原文件读，
+                # 省掉上面copy又被整个重写的一次无谓拷贝
+                for path, _, opt_path in tool_pending:
+                    src = opt_path if _stat(opt_path) is not None else path
+                    result = subprocess.run([tools['zopflipng'], '-y', src, opt_path],
+                                            capture_output=True, **_SPAWN_OPTS)
+                    if result.returncode != 0:
+                        batch_failed = True
+        elif tool_pending and not tools['pngquant']:
+            logger.warning("PNG压缩工具不可用，跳过本批文件")
+    except Exception as e:
+        logger.error(f"PNG批量压缩异常: {e}")
+        batch_failed = True
+
+    if batch_failed:
+        logger.error("PNG批量压缩部分失败，未压缩的文件将在下次运行重试")
+
+    # 工具链报错只影响真正交给工具的文件，内联压缩的不受波及
+    tool_paths = {path for path, _, _ in tool_pending}
+    for path, original_size, opt_path in pending:
+        results.append(_finalize_opt(path, original_size, opt_path,
+                                     parsed_sizes.get(opt_path),
+                                     batch_failed and path in tool_paths))
+    return results
+
+
+def compress_gif_batch(paths: List[str], tools: dict, backup_cfg: Tuple
+                       ) -> List[FileResult]:
+    """批量压缩一组GIF文件，整批只调用一次gifsicle"""
+    results: List[FileResult] = []
+    pending = _prepare_batch(paths, backup_cfg, results)
+    if not pending:
+        return results
+
+    batch_failed = False
+    try:
+        if tools['gifsicle']:
+            # gifsicle --batch原地改写，先复制出独立inode的opt副本
+            # 再整批处理（硬链接会让它连原文件一起truncate重写）
+            for path, _, opt_path in pending:
+                _copy_data(path, opt_path)
+            result = subprocess.run(
+                [tools['gifsicle'], '-O3', '--batch']
+                + [opt_path for _, _, opt_path in pending],
+                capture_output=True, **_SPAWN_OPTS)
+            if result.returncode != 0:
+                batch_failed = True
+                logger.error("gifsicle批量压缩部分失败，未压缩的文件将在下次运行重试")
+        else:
+            logger.warning("gifsicle不可用，跳过本批文件")
+    except Exception as e:
+        logger.error(f"GIF批量压缩异常: {e}")
+        batch_failed = True
+
+    for path, original_size, opt_path in pending:
+        results.append(_finalize_opt(path, original_size, opt_path,
+                                     tool_failed=batch_failed))
+    return results
+
+
+def compress_image(input_path: str, quality: int, tools: dict,
+                   backup_cfg: Tuple, relossy: bool = False) -> FileResult:
+    """压缩单个图片文件
+
+    在工作进程中执行，不访问任何共享状态；
+    返回 (路径, 原始大小, 压缩后大小, 状态) 元组供主进程汇总统计。
+    状态取值: 'compressed' / 'skipped' / 'failed'
+    """
+    original_size = 0
+    try:
+        file_ext = Path(input_path).suffix.lower()
+        # 一次stat拿到大小，后续不再重复getsize/exists
+        original_size = os.stat(input_path).st_size
+
+        # 已被优化器处理过的JPEG直接跳过，省下一次工具调用
+        if file_ext in ('.jpg', '.jpeg') and _looks_optimized_jpeg(input_path):
+            logger.info(f"○ 跳过: {input_path} (已优化)")
+            return FileResult(input_path, original_size, original_size, 'skipped')
+
+        # 创建备份
+        if not create_backup(input_path, backup_cfg):
+            logger.error(f"无法创建备份，跳过文件: {input_path}")
+            return FileResult(input_path, original_size, original_size, 'failed')
+
+        # 工具直接读原文件、写<原文件>.opt，免去临时文件的来回拷贝
+        opt_path = f'{input_path}.opt'
+
+        try:
+            # 小文件优先进程内转码，完全绕开子进程
+            compressed = False
+            if original_size < INLINE_THRESHOLD:
+                compressed = _compress_inline(input_path, opt_path, file_ext,
+                                              quality, relossy)
+
+            # 根据文件类型选择压缩方法
+            if compressed:
+                pass
+            elif file_ext in ['.jpg', '.jpeg']:
+                compressed = compress_jpeg(input_path, opt_path, quality, tools, relossy)
+            elif file_ext == '.png':
+                compressed = compress_png(input_path, opt_path, tools)
+            elif file_ext == '.gif':
+                compressed = compress_gif(input_path, opt_path, tools)
+            else:
+                logger.info(f"不支持的格式，跳过: {input_path}")
+                return FileResult(input_path, original_size, original_size, 'skipped')
+
+            if compressed is None:
+                logger.warning(f"压缩工具不可用，跳过: {input_path}")
+                return FileResult(input_path, original_size, original_size, 'skipped')
+            if not compressed:
+                # 工具存在但执行失败（已在压缩函数里记日志）：
+                # 报failed，不进索引，下次运行重试
+                return FileResult(input_path, original_size, original_size, 'failed')
+
+            # 检查压缩效果，有效时替换原文件
+            return _finalize_opt(input_path, original_size, opt_path)
+
+        finally:
+            # 清理残留的中间文件
+            try:
+                os.unlink(opt_path)
+            except OSError:
+                pass
+
+    except FileNotFoundError:
+        logger.error(f"文件不存在: {input_path}")
+        return FileResult(input_path, original_size, original_size, 'failed')
+    except PermissionError:
+        logger.error(f"权限不足: {input_path}")
+        return FileResult(input_path, original_size, original_size, 'failed')
+    except Exception as e:
+        logger.error(f"处理失败: {input_path} - {e}")
+        return FileResult(input_path, original_size, original_size, 'failed')
+
+
+def _init_worker(log_queue, worker_ids) -> None:
+    """工作进程初始化：绑核，并把日志改道到主进程的队列
+
+    工作进程里只做一次QueueHandler入队（纯内存操作），格式化
+    和写盘全部留给主进程的监听线程，多个worker不再抢文件锁。
+    worker_ids是共享计数器，每个worker领一个连续编号来选核——
+    按pid取模会让多个worker撞到同一个核而其它核闲置。
+    """
+    with worker_ids.get_lock():
+        index = worker_ids.value
+        worker_ids.value += 1
+    _pin_worker(index)
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+def _pin_worker(index: int) -> None:
+    """把本进程钉到第index个CPU核上
+
+    固定亲和性后进程不再被调度器在核间迁移，L1/L2缓存和分支
+    预测器状态得以保留。Linux专有接口，其它平台静默跳过。
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            cpu = index % os.cpu_count()
+            os.sched_setaffinity(0, {cpu})
+        except OSError:
+            # 受限环境（容器cpuset等）拒绝设置就保持默认调度
+            pass
+
+
+def _widen_affinity() -> Optional[set]:
+    """临时把亲和性放开到所有核，返回原掩码供恢复
+
+    绑核会被子进程继承：多线程工具（oxipng）在单核掩码下只能
+    时间片轮转，等于白开线程。不可用或失败时返回None。
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    try:
+        mask = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, range(os.cpu_count() or 1))
+        return mask
+    except OSError:
+        return None
+
+
+def _restore_affinity(mask: Optional[set]) -> None:
+    """恢复_widen_affinity保存的亲和性掩码"""
+    if mask is None:
+        return
+    try:
+        os.sched_setaffinity(0, mask)
+    except OSError:
+        pass
+
 
 class ImageCompressor:
-    def __init__(self, backup_enabled=True, backup_dir=DEFAULT_BACKUP_DIR, force_no_backup_check=False):
+    def __init__(self, backup_enabled=True, backup_dir=DEFAULT_BACKUP_DIR,
+                 force_no_backup_check=False, durable=False):
         self.backup_enabled = backup_enabled
         self.backup_dir = backup_dir
         self.force_no_backup_check = force_no_backup_check
+        # durable=True时收尾对每个改动过的目录fsync一次；
+        # 热路径上从不逐文件fsync（那会把每次替换变成同步写盘）
+        self.durable = durable
+        self._dirty_dirs = set()
+        # cwd和备份目录绝对路径只解析一次，避免每个文件一次getcwd/resolve
+        self._cwd = Path.cwd()
+        self._backup_abs = str((self._cwd / backup_dir).resolve())
+        if backup_enabled and not force_no_backup_check:
+            # 备份根目录提前建好，create_backup里只补建子目录
+            Path(backup_dir).mkdir(exist_ok=True)
         self.stats = {
             'total_files': 0,
             'processed': 0,
             'compressed': 0,
+            'cached': 0,
             'failed': 0,
             'original_size': 0,
             'compressed_size': 0,
             'space_saved': 0
         }
+        self._cache = self._load_cache()
+        # 本轮运行模式，process_files开始时设置；_has_tool_for要靠它
+        # 判断JPEG的可用工具
+        self._relossy = False
         self.setup_logging()
         self.check_dependencies()
-    
+
+    def _load_cache(self) -> dict:
+        """加载上次运行的处理索引，损坏或缺失时从空索引开始"""
+        try:
+            with open(DEFAULT_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if isinstance(cache, dict):
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _cache_key(self, file_path: str) -> str:
+        """索引键用绝对路径，避免从不同目录启动时错配"""
+        if os.path.isabs(file_path):
+            return os.path.normpath(file_path)
+        return os.path.normpath(os.path.join(str(self._cwd), file_path))
+
+    def _is_cached(self, file_path: str) -> bool:
+        """文件的(大小, mtime_ns)与上次处理后一致即可整个跳过"""
+        entry = self._cache.get(self._cache_key(file_path))
+        if entry is None:
+            return False
+        st = _stat(file_path)
+        return st is not None and entry == [st.st_size, st.st_mtime_ns]
+
+    def _has_tool_for(self, file_path: str) -> bool:
+        """该格式对应的压缩工具是否可用（不可用导致的跳过不进索引）
+
+        JPEG要看运行模式：--relossy只认cjpeg，缺了它jpegtran在场
+        也帮不上忙；默认模式两者任一即可。模式判断错会把"本次
+        模式无工具"的跳过缓存住，换回有工具的模式也不再处理。
+        """
+        ext = Path(file_path).suffix.lower()
+        if ext in ('.jpg', '.jpeg'):
+            if self._relossy:
+                return bool(self.available_tools['mozjpeg'])
+            return bool(self.available_tools['mozjpeg'] or
+                        self.available_tools['jpegtran'])
+        if ext == '.png':
+            return (self.available_tools['pngquant'] or
+                    self.available_tools['oxipng'] or
+                    self.available_tools['optipng'] or
+                    self.available_tools['zopflipng'])
+        if ext == '.gif':
+            return self.available_tools['gifsicle']
+        # 不支持的格式怎么跑都会跳过，进索引省得反复分发
+        return True
+
+    def _remember_result(self, file_path: str) -> None:
+        """处理完（压缩或确认无需压缩）后登记当前大小和mtime"""
+        st = _stat(file_path)
+        if st is not None:
+            self._cache[self._cache_key(file_path)] = [st.st_size, st.st_mtime_ns]
+
     def setup_logging(self):
-        """设置日志记录"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(DEFAULT_LOG_FILE, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        """设置日志记录：单写者队列模式
+
+        所有进程（含主进程）只把LogRecord塞进队列，由一个监听
+        线程统一格式化、写终端和日志文件——热路径上不再逐条拿
+        handler锁、格式化时间戳并刷盘。文件侧用delay=True延迟
+        打开，外面套MemoryHandler攒满1024条才落盘，另起线程每
+        秒补刷一次兜住尾部延迟。
+        """
+        self._log_queue = _mp_context().Queue(-1)
+
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        file_handler = logging.FileHandler(DEFAULT_LOG_FILE, encoding='utf-8', delay=True)
+        file_handler.setFormatter(formatter)
+        self._memory_handler = logging.handlers.MemoryHandler(1024, target=file_handler)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.handlers = [logging.handlers.QueueHandler(self._log_queue)]
+
+        self._log_listener = logging.handlers.QueueListener(
+            self._log_queue, self._memory_handler, stream_handler)
+        self._log_listener.start()
+
+        self._stop_log_flush = threading.Event()
+
+        def _flush_loop():
+            while not self._stop_log_flush.wait(1.0):
+                self._memory_handler.flush()
+
+        self._log_flush_thread = threading.Thread(target=_flush_loop, daemon=True)
+        self._log_flush_thread.start()
+
         self.logger = logging.getLogger(__name__)
-    
+
+    def _shutdown_logging(self):
+        """停掉日志监听并把攒着的记录全部落盘（可重复调用）"""
+        if self._log_listener is None:
+            return
+        self._stop_log_flush.set()
+        self._log_flush_thread.join()
+        self._log_listener.stop()
+        self._memory_handler.close()
+        self._log_listener = None
+
     def check_dependencies(self):
         """检查外部工具依赖"""
+        # 普通dict，保证可以pickle后传给工作进程。存which解析出的
+        # 绝对路径（找不到为None）：省去每次调用的PATH查找，且只有
+        # 带目录的argv[0]才能走posix_spawn快速路径
         self.available_tools = {
-            'mozjpeg': shutil.which('cjpeg') is not None,
-            'optipng': shutil.which('optipng') is not None,
-            'pngquant': shutil.which('pngquant') is not None,
-            'zopflipng': shutil.which('zopflipng') is not None,
-            'cwebp': shutil.which('cwebp') is not None,
-            'gifsicle': shutil.which('gifsicle') is not None
+            'mozjpeg': shutil.which('cjpeg'),
+            'jpegtran': shutil.which('jpegtran'),
+            'optipng': shutil.which('optipng'),
+            'pngquant': shutil.which('pngquant'),
+            'oxipng': shutil.which('oxipng'),
+            'zopflipng': shutil.which('zopflipng'),
+            'cwebp': shutil.which('cwebp'),
+            'gifsicle': shutil.which('gifsicle')
         }
-        
-        missing_tools = [tool for tool, available in self.available_tools.items() if not available]
+
+        missing_tools = [tool for tool, path in self.available_tools.items() if path is None]
         if missing_tools:
             self.logger.warning(f"缺少以下工具，部分功能可能受限: {', '.join(missing_tools)}")
-            self.logger.info("安装建议 (macOS): brew install mozjpeg optipng pngquant zopfli webp gifsicle")
-    
-    def create_backup(self, file_path: str) -> bool:
-        """创建文件备份"""
-        # 如果强制禁用备份检查，直接返回成功
-        if self.force_no_backup_check:
-            return True
-            
-        if not self.backup_enabled:
-            return True
-        
-        try:
-            backup_path = Path(self.backup_dir)
-            backup_path.mkdir(exist_ok=True)
-            
-            # 保持原始目录结构
-            rel_path = Path(file_path).relative_to(Path.cwd())
-            backup_file = backup_path / rel_path
-            backup_file.parent.mkdir(parents=True, exist_ok=True)
-            
-            shutil.copy2(file_path, backup_file)
-            return True
-        except Exception as e:
-            self.logger.error(f"备份失败 {file_path}: {e}")
-            return False
-    
-    def compress_jpeg(self, temp_path: str, quality: int) -> bool:
-        """压缩JPEG文件"""
-        try:
-            if self.available_tools['mozjpeg']:
-                # 使用mozjpeg压缩
-                result = subprocess.run([
-                    'cjpeg', '-quality', str(quality), '-optimize', 
-                    '-progressive', '-outfile', f'{temp_path}.tmp', temp_path
-                ], capture_output=True, text=True, check=True)
-                
-                if os.path.exists(f'{temp_path}.tmp'):
-                    os.replace(f'{temp_path}.tmp', temp_path)
-                    return True
-            else:
-                self.logger.warning("mozjpeg不可用，跳过JPEG优化")
-            return False
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"JPEG压缩失败: {e.stderr}")
-            return False
-        except Exception as e:
-            self.logger.error(f"JPEG压缩异常: {e}")
-            return False
-    
-    def compress_png(self, temp_path: str) -> bool:
-        """压缩PNG文件"""
-        compressed = False
-        
-        try:
-            # 使用pngquant进行有损压缩（可选）
-            if self.available_tools['pngquant']:
-                result = subprocess.run([
-                    'pngquant', '--quality=65-80', '--output', f'{temp_path}.tmp', temp_path
-                ], capture_output=True, text=True)
-                
-                if result.returncode == 0 and os.path.exists(f'{temp_path}.tmp'):
-                    os.replace(f'{temp_path}.tmp', temp_path)
-                    compressed = True
-            
-            # 使用optipng进行无损优化
-            if self.available_tools['optipng']:
-                subprocess.run([
-                    'optipng', '-o2', '-quiet', temp_path
-                ], capture_output=True, check=True)
-                compressed = True
-            
-            # 使用zopflipng进一步优化
-            elif self.available_tools['zopflipng']:
-                subprocess.run([
-                    'zopflipng', '-y', temp_path, temp_path
-                ], capture_output=True, check=True)
-                compressed = True
-            
-            return compressed
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"PNG压缩失败: {e}")
-            return False
-        except Exception as e:
-            self.logger.error(f"PNG压缩异常: {e}")
-            return False
-    
-    def compress_gif(self, temp_path: str) -> bool:
-        """压缩GIF文件"""
-        try:
-            if self.available_tools['gifsicle']:
-                subprocess.run([
-                    'gifsicle', '-O3', '--batch', temp_path
-                ], capture_output=True, check=True)
-                return True
-            return False
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"GIF压缩失败: {e}")
-            return False
-        except Exception as e:
-            self.logger.error(f"GIF压缩异常: {e}")
-            return False
-    
-    def compress_image(self, input_path: str, quality: int = 85) -> bool:
-        """压缩单个图片文件"""
-        try:
-            file_ext = Path(input_path).suffix.lower()
-            original_size = os.path.getsize(input_path)
-            
-            # 创建备份
-            if not self.create_backup(input_path):
-                self.logger.error(f"无法创建备份，跳过文件: {input_path}")
-                return False
-            
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as temp_file:
-                temp_path = temp_file.name
-            
-            try:
-                # 复制到临时文件
-                shutil.copy2(input_path, temp_path)
-                
-                # 根据文件类型选择压缩方法
-                compressed = False
-                if file_ext in ['.jpg', '.jpeg']:
-                    compressed = self.compress_jpeg(temp_path, quality)
-                elif file_ext == '.png':
-                    compressed = self.compress_png(temp_path)
-                elif file_ext == '.gif':
-                    compressed = self.compress_gif(temp_path)
-                else:
-                    self.logger.info(f"不支持的格式，跳过: {input_path}")
-                    return False
-                
-                if not compressed:
-                    self.logger.warning(f"压缩工具不可用，跳过: {input_path}")
-                    return False
-                
-                # 检查压缩效果
-                compressed_size = os.path.getsize(temp_path)
-                if compressed_size < original_size:
-                    # 压缩有效，替换原文件
-                    shutil.copy2(temp_path, input_path)
-                    
-                    # 更新统计信息
-                    self.stats['compressed'] += 1
-                    self.stats['original_size'] += original_size
-                    self.stats['compressed_size'] += compressed_size
-                    self.stats['space_saved'] += (original_size - compressed_size)
-                    
-                    reduction = 100 * (1 - compressed_size / original_size)
-                    self.logger.info(f"✓ 压缩成功: {input_path} ({self._format_size(original_size)} → {self._format_size(compressed_size)}, 减少 {reduction:.1f}%)")
-                    return True
-                else:
-                    self.logger.info(f"○ 跳过: {input_path} (压缩后更大)")
-                    return False
-                    
-            finally:
-                # 清理临时文件
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
-                    
-        except FileNotFoundError:
-            self.logger.error(f"文件不存在: {input_path}")
-            self.stats['failed'] += 1
-            return False
-        except PermissionError:
-            self.logger.error(f"权限不足: {input_path}")
-            self.stats['failed'] += 1
-            return False
-        except Exception as e:
-            self.logger.error(f"处理失败: {input_path} - {e}")
-            self.stats['failed'] += 1
-            return False
-        finally:
-            self.stats['processed'] += 1
-    
+            self.logger.info("安装建议 (macOS): brew install mozjpeg optipng oxipng pngquant zopfli webp gifsicle")
+
+    def _record_result(self, result: FileResult, totals: dict) -> None:
+        """把单个文件的结果累加进本地计数器（不直接写self.stats）"""
+        totals['processed'] += 1
+
+        if result.status == 'compressed':
+            totals['compressed'] += 1
+            totals['original_size'] += result.original
+            totals['compressed_size'] += result.compressed
+            totals['space_saved'] += (result.original - result.compressed)
+
+            # 逐文件成功行降到DEBUG（默认INFO级别下直接丢弃，零格式化开销）
+            reduction = 100 * (1 - result.compressed / result.original)
+            self.logger.debug(f"✓ 压缩成功: {result.path} ({self._format_size(result.original)} → {self._format_size(result.compressed)}, 减少 {reduction:.1f}%)")
+        elif result.status == 'failed':
+            totals['failed'] += 1
+
+        # 每100个文件给一条INFO汇总，代替逐文件刷屏
+        if totals['processed'] % 100 == 0:
+            self.logger.info(
+                f"已处理 {totals['processed']} 个文件，压缩 {totals['compressed']} 个，"
+                f"累计节省 {self._format_size(totals['space_saved'])}")
+
+        if result.status == 'compressed' and self.durable:
+            self._dirty_dirs.add(os.path.dirname(result.path) or '.')
+
+        # 压缩过或确认无需压缩的文件都登记索引；失败的、
+        # 以及因工具缺失而跳过的，下次运行再试
+        if result.status == 'compressed' or (
+                result.status == 'skipped' and self._has_tool_for(result.path)):
+            self._remember_result(result.path)
+
     def _format_size(self, size_bytes: int) -> str:
         """格式化文件大小"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -249,47 +1023,173 @@ class ImageCompressor:
                 return f"{size_bytes:.1f}{unit}"
             size_bytes /= 1024
         return f"{size_bytes:.1f}TB"
-    
-    def find_image_files(self, directory: str, recursive: bool = True) -> List[str]:
-        """查找图片文件"""
-        image_files = []
-        directory_path = Path(directory)
-        
-        if recursive:
-            pattern = '**/*'
-        else:
-            pattern = '*'
-        
-        for file_path in directory_path.glob(pattern):
-            if (file_path.is_file() and 
-                file_path.suffix.lower() in IMAGE_EXTENSIONS and
-                not str(file_path).startswith(self.backup_dir)):
-                image_files.append(str(file_path))
-        
-        return sorted(image_files)
-    
-    def process_files(self, files: List[str], quality: int = 85, max_workers: int = 4) -> None:
-        """并行处理文件列表"""
-        self.stats['total_files'] = len(files)
-        
-        if max_workers == 1:
-            # 单线程处理
-            for file_path in tqdm(files, desc="压缩进度"):
-                self.compress_image(file_path, quality)
+
+    def _is_backup_dir(self, dirpath: str, name: str) -> bool:
+        """判断子目录是否就是备份目录（按解析后的绝对路径比较，
+        而不是字符串前缀——前缀会误伤任何同名开头的路径）"""
+        full = os.path.join(dirpath, name)
+        if not os.path.isabs(full):
+            full = os.path.join(str(self._cwd), full)
+        return os.path.normpath(full) == self._backup_abs
+
+    def find_image_files(self, directory: str, recursive: bool = True,
+                         allowed_exts: Optional[frozenset] = None) -> Iterator[str]:
+        """扫描图片文件的生成器，边扫描边产出，不物化整个列表
+
+        基于os.fwalk：按目录fd遍历，不用逐项重新解析长路径，
+        也没有Path.glob每个条目一个PurePath对象的分配开销；
+        备份目录通过原地改dirnames剪枝。
+
+        allowed_exts可进一步收窄格式（--formats），过滤在遍历时
+        就地完成，省掉对完整列表的二次过滤和分配。
+        """
+        if allowed_exts is None:
+            allowed_exts = IMAGE_EXTENSIONS
+        if hasattr(os, 'fwalk'):
+            walker = os.fwalk(directory, onerror=self._walk_error)
         else:
-            # 多线程处理
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                future_to_file = {
-                    executor.submit(self.compress_image, file_path, quality): file_path 
-                    for file_path in files
-                }
-                
-                # 显示进度
-                with tqdm(total=len(files), desc="压缩进度") as pbar:
-                    for future in as_completed(future_to_file):
-                        pbar.update(1)
-    
+            # Windows没有fwalk，退回os.walk（语义一致）
+            walker = ((dirpath, dirnames, filenames, None) for
+                      dirpath, dirnames, filenames in
+                      os.walk(directory, onerror=self._walk_error))
+
+        for dirpath, dirnames, filenames, _dirfd in walker:
+            dirnames[:] = [d for d in dirnames
+                           if not self._is_backup_dir(dirpath, d)]
+            for name in filenames:
+                if os.path.splitext(name)[1].lower() in allowed_exts:
+                    yield os.path.join(dirpath, name)
+            if not recursive:
+                break
+
+    def _walk_error(self, error: OSError) -> None:
+        """目录遍历出错只记日志，不中断整体扫描"""
+        self.logger.warning(f"无法读取目录 {getattr(error, 'filename', '?')}: {error}")
+
+    def _iter_jobs(self, files, quality: int, relossy: bool) -> Iterator[Tuple]:
+        """把文件流转成任务流
+
+        cjpeg只支持单文件，JPEG逐个出任务；png/gif攒够BATCH_SIZE
+        就出一批，收尾时把余量批次补上。产出 (函数, 参数...) 元组。
+        """
+        backup_cfg = (self.backup_enabled, self.backup_dir,
+                      self.force_no_backup_check, str(self._cwd))
+        batch_fns = {'.png': compress_png_batch, '.gif': compress_gif_batch}
+        buckets = {ext: [] for ext in batch_fns}
+
+        for file_path in files:
+            self.stats['total_files'] += 1
+            # 上次跑过且文件没动过：不出任务，重跑近乎零开销
+            if self._is_cached(file_path):
+                self.stats['cached'] += 1
+                continue
+            ext = Path(file_path).suffix.lower()
+            if ext in buckets:
+                bucket = buckets[ext]
+                bucket.append(file_path)
+                if len(bucket) >= BATCH_SIZE:
+                    yield (batch_fns[ext], list(bucket),
+                           self.available_tools, backup_cfg)
+                    bucket.clear()
+            else:
+                yield (compress_image, file_path, quality,
+                       self.available_tools, backup_cfg, relossy)
+
+        for ext, bucket in buckets.items():
+            if bucket:
+                yield (batch_fns[ext], bucket, self.available_tools, backup_cfg)
+
+    def process_files(self, files, quality: int = 85, max_workers: int = 4,
+                      relossy: bool = False) -> None:
+        """处理文件流，扫描与压缩重叠进行"""
+        self._relossy = relossy
+        jobs = self._iter_jobs(files, quality, relossy)
+
+        # 结果先累加到本地计数器，收尾时一次并入self.stats，
+        # 避免热路径上反复写共享的stats字典
+        totals = dict.fromkeys(
+            ('processed', 'compressed', 'failed',
+             'original_size', 'compressed_size', 'space_saved'), 0)
+
+        # 进度条不在完成热路径里逐次update（那会每次拿tqdm的锁并
+        # 重绘），由后台线程每0.1秒按计数器刷新一次
+        stop_refresh = threading.Event()
+
+        def _refresh_progress(pbar):
+            while not stop_refresh.wait(0.1):
+                pbar.n = totals['processed']
+                pbar.refresh()
+
+        # 总量未知，用计数型进度条
+        with tqdm(desc="压缩进度", unit="个") as pbar:
+            refresher = threading.Thread(
+                target=_refresh_progress, args=(pbar,), daemon=True)
+            refresher.start()
+            try:
+                if max_workers == 1:
+                    # 单进程处理
+                    for fn, *job_args in jobs:
+                        self._record_results(fn(*job_args), totals)
+                else:
+                    # 多进程处理：每个worker有独立的GIL和解释器，
+                    # 避免copy/stat/日志等Python侧开销在线程间串行化
+                    ctx = _mp_context()
+                    # 共享计数器给每个worker发连续编号，绑核不撞车
+                    worker_ids = ctx.Value('i', 0)
+                    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx,
+                                             initializer=_init_worker,
+                                             initargs=(self._log_queue, worker_ids)) as executor:
+                        # 限制在途任务数，让扫描和压缩并行推进而不积压内存
+                        max_inflight = max_workers * 4
+                        inflight = set()
+
+                        for fn, *job_args in jobs:
+                            inflight.add(executor.submit(fn, *job_args))
+                            if len(inflight) >= max_inflight:
+                                done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                                for future in done:
+                                    self._record_results(future.result(), totals)
+
+                        for future in as_completed(inflight):
+                            self._record_results(future.result(), totals)
+            finally:
+                stop_refresh.set()
+                refresher.join()
+            # 收尾补画最终计数
+            pbar.n = totals['processed']
+            pbar.refresh()
+
+        for key, value in totals.items():
+            self.stats[key] += value
+
+        if self.durable:
+            self._sync_dirs()
+
+    def _sync_dirs(self) -> None:
+        """对本次改动过的每个目录fsync一次，确保rename落盘
+
+        os.replace只改目录项，掉电时新目录项可能还没持久化。
+        逐文件fsync会让吞吐跌一个数量级，所以攒到收尾按目录
+        去重后统一刷——每个目录只付一次同步写的代价。
+        """
+        for dirpath in sorted(self._dirty_dirs):
+            try:
+                fd = os.open(dirpath, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self.logger.warning(f"目录fsync失败 {dirpath}: {e}")
+        self._dirty_dirs.clear()
+
+    def _record_results(self, result, totals: dict) -> None:
+        """汇总单个任务的结果（单个FileResult或整批的列表）"""
+        if not isinstance(result, list):
+            result = [result]
+        for item in result:
+            self._record_result(item, totals)
+
     def print_summary(self):
         """打印处理摘要"""
         print("\n" + "="*50)
@@ -298,18 +1198,26 @@ class ImageCompressor:
         print(f"总文件数: {self.stats['total_files']}")
         print(f"已处理: {self.stats['processed']}")
         print(f"成功压缩: {self.stats['compressed']}")
+        print(f"命中缓存跳过: {self.stats['cached']}")
         print(f"失败: {self.stats['failed']}")
-        
+
         if self.stats['compressed'] > 0:
             print(f"原始总大小: {self._format_size(self.stats['original_size'])}")
             print(f"压缩后大小: {self._format_size(self.stats['compressed_size'])}")
             print(f"节省空间: {self._format_size(self.stats['space_saved'])}")
-            
+
             total_reduction = 100 * (self.stats['space_saved'] / self.stats['original_size'])
             print(f"总体压缩率: {total_reduction:.1f}%")
-        
+
         print("="*50)
-        
+
+        # 持久化处理索引，供下次重跑跳过未变化的文件
+        try:
+            with open(DEFAULT_CACHE_FILE, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, ensure_ascii=False)
+        except OSError as e:
+            self.logger.warning(f"处理索引保存失败: {e}")
+
         # 保存统计信息到文件
         stats_file = f"compression_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         with open(stats_file, 'w', encoding='utf-8') as f:
@@ -333,87 +1241,96 @@ def main():
   %(prog)s /path/to/images --force-no-backup-check  # 完全跳过备份检查
         """
     )
-    
+
     parser.add_argument('directory', help='要处理的目录路径')
-    parser.add_argument('--quality', type=int, default=85, 
-                       help='JPEG压缩质量 (1-100), 默认85')
-    parser.add_argument('--recursive', action='store_true', 
+    parser.add_argument('--quality', type=int, default=85,
+                       help='JPEG压缩质量 (1-100), 默认85, 仅--relossy时生效')
+    parser.add_argument('--relossy', action='store_true',
+                       help='用cjpeg按质量重编码JPEG（有损）；默认用jpegtran无损重优化')
+    parser.add_argument('--recursive', action='store_true',
                        help='递归处理子目录')
-    parser.add_argument('--no-backup', action='store_true', 
+    parser.add_argument('--no-backup', action='store_true',
                        help='不创建备份文件')
     parser.add_argument('--backup-dir', default=DEFAULT_BACKUP_DIR,
                        help=f'备份目录路径，默认: {DEFAULT_BACKUP_DIR}')
     parser.add_argument('--workers', type=int, default=4,
-                       help='并行处理线程数，默认4')
-    parser.add_argument('--formats', nargs='+', 
+                       help='并行工作进程数，默认4')
+    parser.add_argument('--formats', nargs='+',
                        choices=['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tiff'],
                        help='指定要处理的图片格式')
     parser.add_argument('--dry-run', action='store_true',
                        help='预览模式，只显示将要处理的文件')
     parser.add_argument('--force-no-backup-check', action='store_true',
                        help='完全跳过备份检查，适用于处理不在当前目录的文件')
-    
+    parser.add_argument('--durable', action='store_true',
+                       help='收尾时对每个改动过的目录fsync，确保替换在掉电后仍可见；'
+                            '默认关闭（交给操作系统回写，速度优先）')
+
     args = parser.parse_args()
-    
+
     # 验证参数
     if not os.path.isdir(args.directory):
         print(f"错误: 目录不存在 - {args.directory}")
         return 1
-    
+
     if not 1 <= args.quality <= 100:
         print("错误: 质量参数必须在1-100之间")
         return 1
-    
+
     if args.workers < 1:
-        print("错误: 线程数必须大于0")
+        print("错误: 进程数必须大于0")
         return 1
-    
+
     # 创建压缩器
     compressor = ImageCompressor(
         backup_enabled=not args.no_backup,
         backup_dir=args.backup_dir,
-        force_no_backup_check=args.force_no_backup_check
+        force_no_backup_check=args.force_no_backup_check,
+        durable=args.durable
     )
-    
-    # 查找图片文件
-    print(f"正在扫描目录: {args.directory}")
-    image_files = compressor.find_image_files(args.directory, args.recursive)
-    
-    # 过滤文件格式
-    if args.formats:
-        format_extensions = [f'.{fmt}' for fmt in args.formats]
-        image_files = [
-            f for f in image_files 
-            if Path(f).suffix.lower() in format_extensions
-        ]
-    
-    if not image_files:
-        print("未找到符合条件的图片文件")
-        return 0
-    
-    print(f"找到 {len(image_files)} 个图片文件")
-    
-    # 预览模式
-    if args.dry_run:
-        print("\n预览模式 - 将要处理的文件:")
-        for i, file_path in enumerate(image_files[:10], 1):
-            size = compressor._format_size(os.path.getsize(file_path))
-            print(f"{i:3d}. {file_path} ({size})")
-        
-        if len(image_files) > 10:
-            print(f"... 还有 {len(image_files) - 10} 个文件")
-        
-        print(f"\n总计: {len(image_files)} 个文件")
+
+    # 日志监听线程要在每条退出路径上收掉（含--dry-run和未找到
+    # 文件的提前返回），否则解释器退出时会偶发EOFError
+    try:
+        # 查找图片文件（生成器，边扫描边消费；--formats在遍历中就地过滤）
+        print(f"正在扫描目录: {args.directory}")
+        allowed_exts = (frozenset(f'.{fmt}' for fmt in args.formats)
+                        if args.formats else None)
+        image_files = compressor.find_image_files(
+            args.directory, args.recursive, allowed_exts)
+
+        # 预览模式需要总数，物化列表
+        if args.dry_run:
+            image_files = list(image_files)
+            if not image_files:
+                print("未找到符合条件的图片文件")
+                return 0
+
+            print("\n预览模式 - 将要处理的文件:")
+            for i, file_path in enumerate(image_files[:10], 1):
+                size = compressor._format_size(os.path.getsize(file_path))
+                print(f"{i:3d}. {file_path} ({size})")
+
+            if len(image_files) > 10:
+                print(f"... 还有 {len(image_files) - 10} 个文件")
+
+            print(f"\n总计: {len(image_files)} 个文件")
+            return 0
+
+        # 开始处理，扫描和压缩重叠进行
+        print(f"开始压缩，使用 {args.workers} 个进程...")
+        compressor.process_files(image_files, args.quality, args.workers, args.relossy)
+
+        if compressor.stats['total_files'] == 0:
+            print("未找到符合条件的图片文件")
+            return 0
+
+        # 显示摘要
+        compressor.print_summary()
+
         return 0
-    
-    # 开始处理
-    print(f"开始压缩，使用 {args.workers} 个线程...")
-    compressor.process_files(image_files, args.quality, args.workers)
-    
-    # 显示摘要
-    compressor.print_summary()
-    
-    return 0
+    finally:
+        compressor._shutdown_logging()
 
 if __name__ == "__main__":
     exit(main())